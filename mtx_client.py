@@ -6,8 +6,11 @@ Remote Server Client.
 Classes and constants for communicating with the trough
 """
 
+import collections
+import re
 import socket
 import threading
+import time
 
 
 # Indices to fields in the measurement data returned by 'GetData'
@@ -34,6 +37,36 @@ uTSteppingStatus = 19
 uTDeviceStatus = 20
 uTLastError = 21
 
+# Measurement data returned by 'GetData'.  Fields can be read by name, or
+# by index using the constants above
+TroughSample = collections.namedtuple(
+    "TroughSample",
+    [
+        "status",
+        "voltage",
+        "pressure",
+        "tension",
+        "area",
+        "area_per_chains",
+        "temperature1",
+        "temperature2",
+        "potential",
+        "radioactivity",
+        "aux1",
+        "aux2",
+        "aux3",
+        "position",
+        "speed",
+        "compression_rate",
+        "time",
+        "dip_position",
+        "dip_speed",
+        "stepping_status",
+        "device_status",
+        "last_error",
+    ],
+)
+
 # Device status codes
 # How to interpret the value at index 20 in the GetData result
 DstIdle = 0
@@ -46,9 +79,27 @@ DstTargetReached = 6
 DstBarrierInit = 7
 DstBarrierInitDone = 8
 
+# Device status names, indexed by device status code
+_dst_strs = (
+    "Idle",
+    "Tensiometer",
+    "CompressionIsotherm",
+    "ConstantArea",
+    "ConstantPressure",
+    "Manual",
+    "TargetReached",
+    "BarrierInit",
+    "BarrierInitDone",
+)
+
 
 def connect(host, port):
     sock = socket.create_connection((host, port))
+    # Commands are short request/response exchanges, so send each one
+    # immediately rather than waiting to coalesce small writes
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    # Detect a dead connection to the server
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
     prologue = sock.recv(1024).decode()
     # TODO check that the prologue makes sense
     print(prologue)
@@ -57,21 +108,20 @@ def connect(host, port):
 
 def dst_to_str(i):
     """Convert device status value to string"""
-    dst_strs = [
-        "Idle",
-        "Tensiometer",
-        "CompressionIsotherm",
-        "ConstantArea",
-        "ConstantPressure",
-        "Manual",
-        "TargetReached",
-        "BarrierInit",
-        "BarrierInitDone",
-    ]
-    try:
-        return dst_strs[i]
-    except IndexError:
-        return "Invalid device status value: %s" % str(i)
+    if 0 <= i < len(_dst_strs):
+        return _dst_strs[i]
+    return f"Invalid device status value: {i}"
+
+
+# Patterns and values for numeric and boolean result fields, so fields can be
+# classified without relying on exceptions
+_int_re = re.compile(rb"[-+]?\d+")
+_float_re = re.compile(rb"[-+]?(\d+\.\d*|\.\d+)([eE][-+]?\d+)?")
+_bools = {b"false": False, b"true": True}
+
+
+# The command PollData sends on every poll
+_getdata_cmd = b"call : GetData\n"
 
 
 # Barrier direction codes
@@ -124,37 +174,51 @@ class Trough(object):
         # Lock to serialize access from multiple threads
         self.lock = threading.Lock()
         self.line_end = b"\n"
+        # Bytes received but not yet returned by _readline.  Each recv reads
+        # as much as is available, which may be more than one line
+        self._pending = bytearray()
 
     # --------------------------------------------------------------------------
     def _readline(self):
-        """Read a line of text from the socket"""
-        s = b""
+        """Read a line from the socket.  The line is returned as bytes, and
+        only the parts of it that are text are decoded later."""
+        # Several responses may arrive together (see call_many), so return
+        # only the first line and keep the rest for the next call
+        buf = self._pending
+        start = 0
         while True:
-            rdata = self.sock.recv(1024)
+            # Check for complete line
+            i = buf.find(self.line_end, start)
+            if i >= 0:
+                end = i + len(self.line_end)
+                line = bytes(buf[:end])
+                del buf[:end]
+                return line
+            # Only the newly received bytes (and any partial line_end before
+            # them) need scanning next time
+            start = max(0, len(buf) - len(self.line_end) + 1)
+            rdata = self.sock.recv(16384)
             if len(rdata) == 0:
                 # Connection closed
                 return
-            s += rdata
-            # Check for complete line
-            if s.endswith(self.line_end):
-                break
-        return s.decode()
+            buf.extend(rdata)
 
     # --------------------------------------------------------------------------
     def _parse_response(self, response):
         """Parse response to trough command.  It's expected to have the form
         'OK: [ <status-code> [ <result-1> <result-2> ... ] ]'
         Check the response begins with 'OK:'.
-        Return a list containing the status-code and ant result fields.
+        Return a list containing the status-code and ant result fields,
+        as bytes.
         Raise TroughError exception if the response indicates an error.
         """
         try:
-            (ok, body) = response.split(":", 1)
+            (ok, body) = response.split(b":", 1)
         except ValueError:
             # missing ':'
-            raise TroughError(response)
-        if not ok.startswith("OK"):
-            raise TroughError(response)
+            raise TroughError(response.decode())
+        if not ok.startswith(b"OK"):
+            raise TroughError(response.decode())
         result = body.split(None)  # split on whitespace, discarding empty strings
 
         return result
@@ -162,44 +226,92 @@ class Trough(object):
     # --------------------------------------------------------------------------
     def _map_str_to_number(self, str_vals):
         def str_to_number(s):
-            try:
-                # See if 's' can be converted to a number
-                if "." in s:
-                    return float(s)
-                else:
-                    return int(s)
-            except ValueError:
-                # Now try a boolean
-                bools = {"false": False, "true": True}
-                try:
-                    b = bools[s.lower()]
-                    return b
-                except KeyError:
-                    # Give up, return the original string
-                    return s
+            # See if 's' can be converted to a number
+            if _int_re.fullmatch(s):
+                return int(s)
+            if _float_re.fullmatch(s):
+                return float(s)
+            # Now try a boolean
+            s_lower = s.lower()
+            if s_lower in _bools:
+                return _bools[s_lower]
+            # Give up, return the original string
+            return s.decode()
 
         return tuple(map(str_to_number, str_vals))
 
+    # --------------------------------------------------------------------------
+    def _map_getdata(self, str_vals):
+        """Convert the fields of a GetData result.  The measurement data is
+        all numeric, so skip the general conversion unless that fails.
+        A result with the expected number of fields is returned as a
+        TroughSample, any other result as a plain tuple."""
+        try:
+            # Fields keep the type they were sent as: float if there is a '.'
+            result = [float(s) if b"." in s else int(s) for s in str_vals]
+        except ValueError:
+            result = self._map_str_to_number(str_vals)
+        if len(result) == len(TroughSample._fields):
+            return TroughSample._make(result)
+        return tuple(result)
+
+    # --------------------------------------------------------------------------
+    def _call_cmd(self, method, args):
+        """Format a trough method call as a command to send to the server"""
+        if method == "GetData" and not args:
+            # PollData sends this continually, so it is encoded in advance
+            return _getdata_cmd
+        elif args:
+            params = " ".join(map(str, args))
+            return f"call : {method} {params}\n".encode()
+        else:
+            return f"call : {method}\n".encode()
+
     # --------------------------------------------------------------------------
     def call(self, *args):
         """Call a trough method, with parameters"""
         method = args[0]
-        args = args[1:]
-        cmd = " ".join([method] + [str(arg) for arg in args])
+        payload = self._call_cmd(method, args[1:])
         with self.lock:
-            self.sock.send(("call : " + cmd + "\n").encode())
+            self.sock.sendall(payload)
             response = self._readline()
 
+        return self._call_result(method, response)
+
+    # --------------------------------------------------------------------------
+    def call_many(self, *calls):
+        """Call several trough methods, sending all the commands at once.
+        Each call is a tuple of the method name followed by its parameters.
+        Return a list of the results, in the same order as the calls.
+        Raise TroughError for the first call that results in an error.
+        Only method calls can be batched, not get/set/ctrl commands.
+        The server must accept pipelined commands, which is not documented
+        for the Remote Access Server, so check before relying on this."""
+        payload = b"".join(self._call_cmd(call[0], call[1:]) for call in calls)
+        with self.lock:
+            self.sock.sendall(payload)
+            # Read every response, so none are left waiting in the socket
+            responses = [self._readline() for call in calls]
+
+        return [
+            self._call_result(call[0], response)
+            for call, response in zip(calls, responses)
+        ]
+
+    # --------------------------------------------------------------------------
+    def _call_result(self, method, response):
+        """Convert the response to a trough method call into its result"""
         # Split the response into fields
         result = self._parse_response(response)
 
+        if method == "GetData":
+            # Keep the <status-code>.  It is the count of pending messages
+            return self._map_getdata(result)
+
         # Convert strings to numbers/bools where possible
         result = self._map_str_to_number(result)
 
-        if method == "GetData":
-            # Keep the <status-code>.  It is the count of pending messages
-            return result
-        elif method == "DeviceIdentification":
+        if method == "DeviceIdentification":
             # Keep the <status-code>.  It is actually part of the device identification
             return result
         elif len(result) == 0:
@@ -218,8 +330,9 @@ class Trough(object):
     # --------------------------------------------------------------------------
     def get(self, prop):
         """Get a trough property"""
+        cmd = f"get : {prop}\n".encode()
         with self.lock:
-            self.sock.send(("get : " + prop + "\n").encode())
+            self.sock.sendall(cmd)
             response = self._readline()
 
         # Split the response into fields
@@ -231,7 +344,7 @@ class Trough(object):
         # There should be only one item in the result list
         if len(result) != 1:
             raise TroughError(
-                "Property '%s' returned unexpected results:\n%s" % (prop, result)
+                f"Property '{prop}' returned unexpected results:\n{result}"
             )
 
         return result[0]
@@ -239,31 +352,29 @@ class Trough(object):
     # --------------------------------------------------------------------------
     def set(self, prop, value):
         """Set a trough property"""
-        cmd = "set : %s %s\n" % (prop, str(value))
+        cmd = f"set : {prop} {value}\n".encode()
         with self.lock:
-            self.sock.send(cmd.encode())
+            self.sock.sendall(cmd)
             response = self._readline()
 
         # Split the response into fields
         result = self._parse_response(response)
 
-        # Convert strings to numbers/bools where possible
-        result = self._map_str_to_number(result)
-
-        # The result list should be empty
+        # The result list should be empty, so there is nothing to convert
         if len(result) != 0:
+            result = self._map_str_to_number(result)
             raise TroughError(
-                "Property '%s' returned unexpected results:\n%s" % (prop, result)
+                f"Property '{prop}' returned unexpected results:\n{result}"
             )
 
-        return result
+        return ()
 
     # --------------------------------------------------------------------------
     def ctrl(self, ctrl, value):
         """Update a 'control' value in the server"""
-        cmd = "ctrl : %s %s\n" % (ctrl, str(value))
+        cmd = f"ctrl : {ctrl} {value}\n".encode()
         with self.lock:
-            self.sock.send(cmd.encode())
+            self.sock.sendall(cmd)
             response = self._readline()
 
         # Split the response into fields
@@ -274,6 +385,12 @@ class Trough(object):
 
         return result
 
+    # --------------------------------------------------------------------------
+    def close(self):
+        """Close the connection to the trough"""
+        with self.lock:
+            self.sock.close()
+
 
 ###############################################################################
 class PollDataError(Exception):
@@ -284,7 +401,7 @@ class PollDataError(Exception):
         msg - the message from GetData
         data - measurement samples read in this polling cycle (if any)
         """
-        Exception.__init__(msg)
+        Exception.__init__(self, msg)
         self.data = data
 
 
@@ -304,7 +421,9 @@ class PollData(threading.Thread):
         <0 - negative value indicates error.  The thread sets an error flag
             and stops polling until the error flag is cleared.
     After calling GetData to retrieve measurement data, datacb is called
-    with the measurement data passed in as a list of lists.
+    with the measurement data passed in as a list of TroughSample (plain
+    tuples if GetData returns an unexpected number of fields).  The list is
+    reused for the next poll cycle, so datacb must copy it to keep it.
     """
 
     # --------------------------------------------------------------------------
@@ -324,12 +443,14 @@ class PollData(threading.Thread):
         self.datacb = datacb
         self.errcb = errcb
 
+        self._data = []  # Measurement data, reused every poll cycle
         self._event = threading.Event()
         self._error = False
         self._quit = False
 
     # --------------------------------------------------------------------------
     def run(self):
+        next_poll = time.monotonic()
         while True:
             if not self._error:
                 try:
@@ -339,9 +460,25 @@ class PollData(threading.Thread):
                 except PollDataError as err:
                     self._error = True
                     if self.errcb:
-                        self.errorcb(str(err), err.data)
-
-            self._event.wait(self.interval)
+                        self.errcb(str(err), err.data)
+
+            interval = self.interval
+            if interval is None:
+                # Polling suspended until woken
+                delay = None
+            else:
+                # Keep to a fixed cadence, so time spent polling does not
+                # stretch the interval.  Skip missed polls if we fall behind.
+                next_poll += interval
+                delay = next_poll - time.monotonic()
+                if delay < 0:
+                    next_poll -= delay
+                    delay = 0
+            if self._event.wait(delay):
+                # Woken early, restart the cadence from now
+                next_poll = time.monotonic()
+            # Re-arm, otherwise every later wait returns immediately
+            self._event.clear()
             if self._quit:
                 break
 
@@ -358,7 +495,11 @@ class PollData(threading.Thread):
         shorter than the current poll interval.  This ensures a timely
         response if the interval is changed from a long time to a
         short time."""
-        if interval < self._interval:
+        wake = interval is not None and (
+            self._interval is None or interval < self._interval
+        )
+        self._interval = interval
+        if wake:
             self._event.set()
 
     # --------------------------------------------------------------------------
@@ -381,7 +522,8 @@ class PollData(threading.Thread):
 
     # --------------------------------------------------------------------------
     def get_data(self):
-        data = []
+        data = self._data
+        data.clear()
         while True:
             try:
                 vals = self.trough.call("GetData")
@@ -393,4 +535,4 @@ class PollData(threading.Thread):
                 if count == 0:
                     return data
             except TroughError as err:
-                raise PollDataError(str(err), data)
+                raise PollDataError(str(err), list(data))
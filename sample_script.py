@@ -1,20 +1,16 @@
-from __future__ import print_function
-
 __author__ = "Pete Allinson, PGA Embedded Systems Ltd.  pete@pgaembeddedsystems.co.uk"
 __copyright__ = "Copyright 2016 Kibron Inc., All Rights Reserved"
 
 
 """
 Simple client to exercise the MicroTrough remote server
-Tested with Python 2.7 on Windows 8.1
+Requires Python 3.6 or later
 """
 
 import sys
-import socket
 import threading
 import argparse
 import time
-import csv
 import os
 
 # Communications with the trough
@@ -56,19 +52,6 @@ def get_options():
     return args
 
 
-args = get_options()
-
-# Update server address/port
-HOST, PORT = args.host, args.port
-
-
-sock = mtx.connect(HOST, PORT)
-#
-# Connect to the trough interface
-#
-trough = mtx.Trough(sock)
-
-
 class TroughDataHelper(object):
     """Utility class for handling trough data:
 
@@ -84,7 +67,6 @@ class TroughDataHelper(object):
 
     def __init__(self, fname):
         self.fh = open(fname, "w")
-        self.writer = csv.writer(self.fh, lineterminator="\n")
         self.curr_data = None
 
         self.annotation_prefix = "# "
@@ -97,15 +79,18 @@ class TroughDataHelper(object):
 
     def new_data(self, data):
         """Callback from the PollData thread
-        data - list of measurements.  Each measurement is a list of data points
+        data - list of measurements.  Each measurement is a TroughSample of data points
                 sampled by the trough at the same time"""
         with self._flock:
-            for measurement in data:
-                measurement = list(measurement) # convert a tuple to a list before processing
-                measurement[mtx.uTTime] += self._time_offset
-                count = measurement[0]
-                if count > 0:
-                    self.writer.writerow(measurement)
+            # Only measurements with count > 0 are new data.  Copy those to
+            # lists (GetData returns tuples) and apply the time offset
+            rows = [list(measurement) for measurement in data if measurement[0] > 0]
+            time_offset = self._time_offset
+            for row in rows:
+                row[mtx.uTTime] += time_offset
+            # Write the whole poll cycle in one go.  The data is all numeric,
+            # so it needs no CSV quoting
+            self.fh.write("".join(",".join(map(str, row)) + "\n" for row in rows))
 
         self.curr_data = data[-1]
 
@@ -143,286 +128,290 @@ def error_callback(errstr, data):
     print(errstr)
 
 
-#
-#
-# Create a measurement file in the user home directory
-home = os.path.expanduser("~")
-measurement_file = os.path.join(home, "kibron", "measurements", "data_file.csv")
-try:
-    os.makedirs(os.path.dirname(measurement_file))
-except os.error:
-    # Assume error due to path already existing
-    pass
-
-trough_data = TroughDataHelper(measurement_file)
-
-
-# Create and start PollData thread
-# This will run in the background, collecting measurement data from the trough.
-poll_data = mtx.PollData(
-    trough, interval=1.0, datacb=trough_data.new_data, errcb=error_callback
-)
-poll_data.start()
-
-
-# Verbose output
-try:
-    # trough.ctrl('verbosity', 3)
-    trough.ctrl("verbosity", 1)
-except mtx.TroughError as err:
-    print(err)
-    poll_data.quit()
-    sys.exit(1)
-
-
 # Raise this exception to bypass a test case
 class Skip(Exception):
     pass
 
 
-skip = False
-# skip = True
-
-# Do a few simple commands
-#
-try:
-
-    # This should return (quickly) provided the trough is connected and powered
-    result = trough.call("DeviceIdentification")
-    print(result)
-
-    trough.call("NewMeasureMode", mtx.MeIdle)
-except mtx.TroughError as err:
-    print(str(err))
-    poll_data.quit()
-    sys.exit(1)
-
-###############################################################################
-# Open barriers to full extent.
-#
-
-# Make sure data is being received from the trough
-time.sleep(2)
-if trough_data.curr_data is None:
-    print("We don't seem to be receiving data from the trough.")
-    poll_data.quit()
-    sys.exit(1)
-
-try:
-    if skip:
-        raise Skip()
-
-    print("Opening barriers ...")
+def main():
+    args = get_options()
+
+    sock = mtx.connect(args.host, args.port)
+    #
+    # Connect to the trough interface
+    #
+    trough = mtx.Trough(sock)
+
+    #
+    #
+    # Create a measurement file in the user home directory
+    home = os.path.expanduser("~")
+    measurement_file = os.path.join(home, "kibron", "measurements", "data_file.csv")
+    try:
+        os.makedirs(os.path.dirname(measurement_file))
+    except os.error:
+        # Assume error due to path already existing
+        pass
+
+    trough_data = TroughDataHelper(measurement_file)
+
+    # Create and start PollData thread
+    # This will run in the background, collecting measurement data from the trough.
+    poll_data = mtx.PollData(
+        trough, interval=1.0, datacb=trough_data.new_data, errcb=error_callback
+    )
+    poll_data.start()
+
+    # Verbose output
+    try:
+        # trough.ctrl('verbosity', 3)
+        trough.ctrl("verbosity", 1)
+    except mtx.TroughError as err:
+        print(err)
+        poll_data.quit()
+        sys.exit(1)
+
+    skip = False
+    # skip = True
+
+    # Do a few simple commands
+    #
+    try:
+
+        # This should return (quickly) provided the trough is connected and powered
+        result = trough.call("DeviceIdentification")
+        print(result)
+
+        trough.call("NewMeasureMode", mtx.MeIdle)
+    except mtx.TroughError as err:
+        print(str(err))
+        poll_data.quit()
+        sys.exit(1)
+
+    ###############################################################################
+    # Open barriers to full extent.
+    #
+
+    # Make sure data is being received from the trough
+    time.sleep(2)
+    if trough_data.curr_data is None:
+        print("We don't seem to be receiving data from the trough.")
+        poll_data.quit()
+        sys.exit(1)
+
+    try:
+        if skip:
+            raise Skip()
+
+        print("Opening barriers ...")
+
+        # Start barriers separating, quick as we can
+        max_speed = trough.call("GetMaxBarrierSpeed")
+        trough.call("SetBarrierSpeed", max_speed)
+
+        trough.call("StepRelax")
+        while True:
+            # Polling at 1 second intervals, so allow a couple of seconds for
+            # cached barrier status to be updated
+            time.sleep(2)
+            data = trough_data.curr_data
+            if data.stepping_status == mtx.StpStop:
+                # Barriers stop automatically when they reach maximum extent
+                break
 
-    # Start barriers separating, quick as we can
-    max_speed = trough.call("GetMaxBarrierSpeed")
-    trough.call("SetBarrierSpeed", max_speed)
+        max_area = trough_data.curr_data.area
+        print("Barriers at maximum extent, area is", str(max_area))
 
-    trough.call("StepRelax")
-    while True:
-        # Polling at 1 second intervals, so allow a couple of seconds for
-        # cached barrier status to be updated
-        time.sleep(2)
-        data = trough_data.curr_data
-        if data[mtx.uTSteppingStatus] == mtx.StpStop:
-            # Barriers stop automatically when they reach maximum extent
-            break
+        print("... Done")
 
-    max_area = trough_data.curr_data[mtx.uTArea]
-    print("Barriers at maximum extent, area is", str(max_area))
+    except mtx.TroughError as err:
+        print(str(err))
+        poll_data.quit()
+        sys.exit(1)
 
-    print("... Done")
+    except Skip:
+        pass
 
-except mtx.TroughError as err:
-    print(str(err))
-    poll_data.quit()
-    sys.exit(1)
+    ###############################################################################
+    # Example of Manual measurement mode,
+    # Compress barriers while accumulating data,
+    # Barriers moving at quarter max speed
 
-except Skip:
-    pass
+    trough_data.annotate("Starting Manual measurement.")
 
+    skip = True
 
-###############################################################################
-# Example of Manual measurement mode,
-# Compress barriers while accumulating data,
-# Barriers moving at quarter max speed
+    try:
+        if skip:
+            raise Skip()
 
-trough_data.annotate("Starting Manual measurement.")
+        print("Compressing barriers, gathering measurement data ...")
 
-skip = True
+        # Tell the trough to produce measurement samples at 1 second intervals
+        trough.call("SetStoreInterval", 1.0)
 
-try:
-    if skip:
-        raise Skip()
+        trough.call("SetBarrierSpeed", max_speed / 4)
 
-    print("Compressing barriers, gathering measurement data ...")
+        trough.call("NewMeasureMode", mtx.MeManual)
 
-    # Tell the trough to produce measurement samples at 1 second intervals
-    trough.call("SetStoreInterval", 1.0)
+        # Set time_offset in the measurement file when starting measurement
+        now = time.time()  # seconds since the epoch
+        trough_data.time_offset = now  # Will be added to all timestamps
+        trough.call("StartMeasure")
 
-    trough.call("SetBarrierSpeed", max_speed / 4)
+        trough.call("StepCompress")
 
-    trough.call("NewMeasureMode", mtx.MeManual)
+        # Wait until area is three-quarters maximum
+        while True:
+            data = trough_data.curr_data
+            area = data.area
+            print("Area is:", area)
+            if area < max_area * 0.75:
+                break
+            time.sleep(1)
 
-    # Set time_offset in the measurement file when starting measurement
-    now = time.time()  # seconds since the epoch
-    trough_data.time_offset = now  # Will be added to all timestamps
-    trough.call("StartMeasure")
+        trough.call("StepStop")
 
-    trough.call("StepCompress")
+        trough.call("StopMeasure")
 
-    # Wait until area is three-quarters maximum
-    while True:
-        data = trough_data.curr_data
-        area = data[mtx.uTArea]
-        print("Area is:", area)
-        if area < max_area * 0.75:
-            break
-        time.sleep(1)
+        trough_data.annotate("Done.")
+        print("... Done")
 
-    trough.call("StepStop")
+    except mtx.TroughError as err:
+        print(str(err))
+        poll_data.quit()
+        sys.exit(1)
 
-    trough.call("StopMeasure")
+    except Skip:
+        pass
 
-    trough_data.annotate("Done.")
-    print("... Done")
+    ###############################################################################
+    # Example of Constant Area measurement mode for a series of areas.
+    #
 
-except mtx.TroughError as err:
-    print(str(err))
-    poll_data.quit()
-    sys.exit(1)
+    skip = False
 
-except Skip:
-    pass
+    try:
+        if skip:
+            raise Skip()
 
+        msg = "Test Constant Area measurement mode ..."
+        print(msg)
+        trough_data.annotate(msg)
 
-###############################################################################
-# Example of Constant Area measurement mode for a series of areas.
-#
+        # Tell the trough to produce measurement samples at 1 second intervals
+        trough.call("SetStoreInterval", 1.0)
 
-skip = False
+        trough.call("SetBarrierSpeed", max_speed)
 
-try:
-    if skip:
-        raise Skip()
+        trough.call("NewMeasureMode", mtx.MeConstantArea)
 
-    msg = "Test Constant Area measurement mode ..."
-    print(msg)
-    trough_data.annotate(msg)
+        # Loop over these areas, spending 1 minute at each
+        areas_to_test = [12000, 10000, 8000, 6000, 4000]  # mm^2
 
-    # Tell the trough to produce measurement samples at 1 second intervals
-    trough.call("SetStoreInterval", 1.0)
+        # Setting target area in mm^2 is awkward because the trough API call
+        # wants a parameter in Ang.^2-per-chain.
+        # So we need to calculate a scaling factor:
+        max_area_per_chains = trough.call("MaxAreaPerChains")
+        scale = max_area_per_chains / max_area
 
-    trough.call("SetBarrierSpeed", max_speed)
+        for area in areas_to_test:
 
-    trough.call("NewMeasureMode", mtx.MeConstantArea)
+            area_per_chains = area * scale
+            trough.call("SetTargetAreaPerChains", area_per_chains)
 
-    # Loop over these areas, spending 1 minute at each
-    areas_to_test = [12000, 10000, 8000, 6000, 4000]  # mm^2
+            msg = "Moving to target area ..."
+            print(msg)
+            trough_data.annotate(msg)
 
-    # Setting target area in mm^2 is awkward because the trough API call
-    # wants a parameter in Ang.^2-per-chain.
-    # So we need to calculate a scaling factor:
-    max_area_per_chains = trough.call("MaxAreaPerChains")
-    scale = max_area_per_chains / max_area
+            # Set time_offset in the measurement file when starting measurement
+            now = time.time()  # seconds since the epoch
+            trough_data.time_offset = now  # Will be added to all timestamps
+            trough.call("StartMeasure")
 
-    for area in areas_to_test:
+            # Wait until target area is reached
+            while True:
+                time.sleep(2)
 
-        area_per_chains = area * scale
-        trough.call("SetTargetAreaPerChains", area_per_chains)
+                data = trough_data.curr_data
+                area = data.area
+                dst = data.device_status
+                dststr = mtx.dst_to_str(dst)
 
-        msg = "Moving to target area ..."
-        print(msg)
-        trough_data.annotate(msg)
+                print("Area is: {}, Dst is: {}".format(area, dststr))
+                if dst == mtx.DstTargetReached:
+                    break
 
-        # Set time_offset in the measurement file when starting measurement
-        now = time.time()  # seconds since the epoch
-        trough_data.time_offset = now  # Will be added to all timestamps
-        trough.call("StartMeasure")
+            msg = "Waiting ..."
+            print(msg)
+            trough_data.annotate(msg)
 
-        # Wait until target area is reached
-        while True:
-            time.sleep(2)
+            # Issue another StartMeasure (timestamps stopped advancing when the
+            # target area area was reached)
+            now = time.time()  # seconds since the epoch
+            trough_data.time_offset = now  # Will be added to all timestamps
+            trough.call("StartMeasure")
 
-            data = trough_data.curr_data
-            area = data[mtx.uTArea]
-            dst = data[mtx.uTDeviceStatus]
-            dststr = mtx.dst_to_str(dst)
+            # Wait for 1 minute, gathering measurement data
+            time.sleep(60)
 
-            print("Area is: {}, Dst is: {}".format(area, dststr))
-            if dst == mtx.DstTargetReached:
-                break
+            trough.call("StopMeasure")
 
-        msg = "Waiting ..."
+        msg = "Done"
         print(msg)
         trough_data.annotate(msg)
 
-        # Issue another StartMeasure (timestamps stopped advancing when the
-        # target area area was reached)
-        now = time.time()  # seconds since the epoch
-        trough_data.time_offset = now  # Will be added to all timestamps
-        trough.call("StartMeasure")
-
-        # Wait for 1 minute, gathering measurement data
-        time.sleep(60)
-
-        trough.call("StopMeasure")
-
-    msg = "Done"
-    print(msg)
-    trough_data.annotate(msg)
-
-
-except mtx.TroughError as err:
-    print(str(err))
-    poll_data.quit()
-    sys.exit(1)
-
-except Skip:
-    pass
-
-
-###############################################################################
-# Exercise a few trough commands
-
-# Properties:
-try:
-    # Note - these are unlikely to fail because they return data cached in the
-    # trough interface software.  They don't go to the trough interface hardware
-    current_speed = trough.get("CurrentSpeed")
-    current_position = trough.get("CurrentPosition")
-    compression_rate = trough.get("CompressionRate")
-    command_status = trough.get("CommandStatus")
-    com_port = trough.get("ComPort")
-
-    print("A few properties:")
-    print("Current Speed:   ", current_speed)
-    print("Current Position:", current_position)
-    print("Compression Rate:", compression_rate)
-    print("Command Status:  ", mtx.dst_to_str(command_status))
-    print("Com Port:        ", com_port)
-
-except mtx.TroughError as err:
-    print(str(err))
+    except mtx.TroughError as err:
+        print(str(err))
+        poll_data.quit()
+        sys.exit(1)
+
+    except Skip:
+        pass
+
+    ###############################################################################
+    # Exercise a few trough commands
+
+    # Properties:
+    try:
+        # Note - these are unlikely to fail because they return data cached in the
+        # trough interface software.  They don't go to the trough interface hardware
+        current_speed = trough.get("CurrentSpeed")
+        current_position = trough.get("CurrentPosition")
+        compression_rate = trough.get("CompressionRate")
+        command_status = trough.get("CommandStatus")
+        com_port = trough.get("ComPort")
+
+        print("A few properties:")
+        print("Current Speed:   ", current_speed)
+        print("Current Position:", current_position)
+        print("Compression Rate:", compression_rate)
+        print("Command Status:  ", mtx.dst_to_str(command_status))
+        print("Com Port:        ", com_port)
+
+    except mtx.TroughError as err:
+        print(str(err))
+        poll_data.quit()
+        sys.exit(1)
+
+    # Methods
+    try:
+        pass
+
+    except mtx.TroughError as err:
+        print(str(err))
+        poll_data.quit()
+        sys.exit(1)
+
+    #
+    # Quit the PollData thread, close the data file
     poll_data.quit()
-    sys.exit(1)
-
-# Methods
-try:
-    pass
-
-except mtx.TroughError as err:
-    print(str(err))
-    poll_data.quit()
-    sys.exit(1)
-
+    trough_data.close()
 
-#
-# Quit the PollData thread, close the data file
-poll_data.quit()
-trough_data.close()
+    # All done
+    trough.close()
+    sys.exit(0)
 
 
-# All done
-sock.close()
-sys.exit(0)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Tests for mtx_client, using a socket pair in place of the server
+Run with:  python -m unittest test_mtx_client
+"""
+
+import socket
+import threading
+import time
+import unittest
+
+import mtx_client as mtx
+
+
+class TroughTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sock, self.server = socket.socketpair()
+        self.sock.settimeout(2)
+        self.trough = mtx.Trough(self.sock)
+
+    def tearDown(self):
+        self.trough.close()
+        self.server.close()
+
+    def check_call_many_pipelined(self, line_end):
+        self.trough.line_end = line_end
+        # The server answers all the commands in one send
+        responses = [b"OK: 0 1", b"OK: 0 2.5", b"OK: 0 true"]
+        self.server.sendall(b"".join(r + line_end for r in responses))
+
+        result = self.trough.call_many(("A",), ("B",), ("C",))
+
+        self.assertEqual(result, [1, 2.5, True])
+
+    def test_call_many_pipelined_lf(self):
+        self.check_call_many_pipelined(b"\n")
+
+    def test_call_many_pipelined_cr(self):
+        self.check_call_many_pipelined(b"\r")
+
+    def test_call_many_pipelined_lfcr(self):
+        self.check_call_many_pipelined(b"\n\r")
+
+    def test_get_after_timeout(self):
+        self.sock.settimeout(0.2)
+        with self.assertRaises(socket.timeout):
+            self.trough.get("CurrentSpeed")
+
+        # The late response is read by the next command
+        self.server.sendall(b"OK: 5\n")
+        self.assertEqual(self.trough.get("CurrentSpeed"), 5)
+
+    def test_partial_response(self):
+        self.trough.line_end = b"\r\n"
+        self.server.sendall(b"OK: 0 1\r")
+        self.sock.settimeout(0.2)
+        with self.assertRaises(socket.timeout):
+            self.trough.call("A")
+
+        # The start of the response is kept until the rest arrives
+        self.server.sendall(b"\nOK: 0 2\r\n")
+        self.assertEqual(self.trough.call("B"), 1)
+        self.assertEqual(self.trough.call("C"), 2)
+
+    def test_getdata_returns_trough_sample(self):
+        fields = "0" + " 1.5" * 18 + " 0 3 0"
+        self.server.sendall(f"OK: {fields}\n".encode())
+
+        result = self.trough.call("GetData")
+
+        self.assertIsInstance(result, mtx.TroughSample)
+        self.assertEqual(result.device_status, 3)
+
+    def test_getdata_keeps_field_types(self):
+        fields = " ".join(["0"] * 22)
+        self.server.sendall(f"OK: {fields}\n".encode())
+
+        result = self.trough.call("GetData")
+
+        # Fields sent without a '.' stay ints
+        self.assertEqual([type(v) for v in result], [int] * 22)
+
+    def test_getdata_unexpected_type_returns_trough_sample(self):
+        # An int field sent as a float still gives a TroughSample
+        fields = "0" + " 1.5" * 18 + " 0 3 1.0"
+        self.server.sendall(f"OK: {fields}\n".encode())
+
+        result = self.trough.call("GetData")
+
+        self.assertIsInstance(result, mtx.TroughSample)
+        self.assertEqual(result.last_error, 1.0)
+        self.assertEqual(result[mtx.uTDeviceStatus], 3)
+
+    def test_getdata_unexpected_length_returns_tuple(self):
+        self.server.sendall(b"OK: 0 1.5 2\n")
+
+        result = self.trough.call("GetData")
+
+        self.assertEqual(result, (0, 1.5, 2))
+
+
+
+class FakeTrough(object):
+    """Stands in for Trough, recording when GetData is called"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.times = []
+
+    def call(self, method):
+        self.times.append(time.monotonic())
+        if self.error:
+            raise mtx.TroughError(self.error)
+        return (0,)
+
+
+class PollDataTestCase(unittest.TestCase):
+    def start(self, trough, **kwargs):
+        poll_data = mtx.PollData(trough, **kwargs)
+        poll_data.start()
+        self.addCleanup(poll_data.quit)
+        return poll_data
+
+    def test_error_callback(self):
+        errors = []
+        called = threading.Event()
+
+        def errcb(errstr, data):
+            errors.append((errstr, data))
+            called.set()
+
+        poll_data = self.start(FakeTrough("boom"), interval=0.05, errcb=errcb)
+
+        self.assertTrue(called.wait(1))
+        self.assertEqual(errors, [("boom", [])])
+        self.assertTrue(poll_data.error)
+
+    def test_fixed_interval(self):
+        # Time spent in the data callback shouldn't stretch the interval
+        trough = FakeTrough()
+        self.start(trough, interval=0.1, datacb=lambda data: time.sleep(0.03))
+        time.sleep(0.65)
+
+        intervals = [b - a for a, b in zip(trough.times, trough.times[1:])]
+        self.assertGreaterEqual(len(intervals), 4)
+        for interval in intervals:
+            self.assertAlmostEqual(interval, 0.1, delta=0.02)
+
+    def test_quit_is_prompt(self):
+        poll_data = mtx.PollData(FakeTrough(), interval=10)
+        poll_data.start()
+        time.sleep(0.05)
+
+        start = time.monotonic()
+        poll_data.quit()
+
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertFalse(poll_data.is_alive())
+
+    def count_polls(self, trough, secs):
+        before = len(trough.times)
+        time.sleep(secs)
+        return len(trough.times) - before
+
+    def test_shorter_interval(self):
+        trough = FakeTrough()
+        poll_data = self.start(trough, interval=10)
+        time.sleep(0.05)
+
+        poll_data.interval = 0.1
+
+        self.assertEqual(poll_data.interval, 0.1)
+        # Polls at the new interval, rather than spinning after the wake-up
+        self.assertIn(self.count_polls(trough, 0.55), range(4, 8))
+
+    def test_clear_error(self):
+        trough = FakeTrough("boom")
+        poll_data = self.start(trough, interval=0.1)
+        time.sleep(0.05)
+        self.assertTrue(poll_data.error)
+        # Polling stops while the error flag is set
+        self.assertEqual(self.count_polls(trough, 0.3), 0)
+
+        trough.error = None
+        poll_data.error = False
+
+        self.assertIn(self.count_polls(trough, 0.55), range(4, 8))
+
+    def test_suspend(self):
+        trough = FakeTrough()
+        poll_data = self.start(trough, interval=None)
+        time.sleep(0.05)
+        # Only the initial poll
+        self.assertEqual(len(trough.times), 1)
+        self.assertEqual(self.count_polls(trough, 0.3), 0)
+
+        poll_data.interval = 0.1
+        self.assertGreater(self.count_polls(trough, 0.3), 0)
+
+        poll_data.interval = None
+        time.sleep(0.15)
+        self.assertEqual(self.count_polls(trough, 0.3), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()